@@ -42,6 +42,33 @@ if !exists('g:ipy_completefunc')
     let g:ipy_completefunc = 'global'
 endif
 
+" Ask IPython for completions as you type, without blocking insert mode.
+" Requests are sent once you stop typing for g:ipy_complete_delay
+" milliseconds, and the matches pop up through complete() when the reply
+" arrives. If the kernel takes longer than g:ipy_complete_timeout
+" milliseconds (default 300), names from earlier replies and words from the
+" buffer are offered instead.
+if !exists('g:ipy_async_complete')
+    let g:ipy_async_complete = 0
+endif
+if !exists('g:ipy_complete_delay')
+    let g:ipy_complete_delay = 150
+endif
+
+" Talk to the kernel through a helper process (ipy_helper.py) instead of from
+" vim's own Python. Only g:ipy_helper_python needs jupyter_client installed,
+" and the zmq I/O and message rendering happen outside of vim.
+if !exists('g:ipy_use_helper')
+    let g:ipy_use_helper = 0
+endif
+if !exists('g:ipy_helper_python')
+    let g:ipy_helper_python = 'python3'
+endif
+" The helper's stderr (e.g. its traceback if it fails to start) goes here.
+if !exists('g:ipy_helper_log')
+    let g:ipy_helper_log = tempname() . '-vim-ipython-helper.log'
+endif
+
 python3 << EOF
 import vim
 import sys
@@ -51,6 +78,44 @@ from vim_ipython import *
 
 EOF
 
+let s:helper_script = expand('<sfile>:p:h') . '/ipy_helper.py'
+let s:helper_output = get(s:, 'helper_output', [])
+let s:helper_timer = get(s:, 'helper_timer', -1)
+
+" Start the helper process (if it isn't running yet), returns 1 on success.
+fun! IPythonHelperStart()
+    if exists('g:ipy_helper_job') && job_status(g:ipy_helper_job) ==# 'run'
+        return 1
+    endif
+    let g:ipy_helper_job = job_start([g:ipy_helper_python, s:helper_script],
+                \ {'mode': 'json', 'callback': function('s:helper_event'),
+                \  'err_io': 'file', 'err_name': g:ipy_helper_log})
+    return job_status(g:ipy_helper_job) ==# 'run'
+endfun
+
+" Hand over (and forget) the output the helper has pushed so far.
+fun! IPythonHelperOutput()
+    let output = s:helper_output
+    let s:helper_output = []
+    return output
+endfun
+
+fun! s:helper_event(channel, msg)
+    if type(a:msg) != v:t_dict || get(a:msg, 'event', '') !=# 'iopub'
+        return
+    endif
+    call extend(s:helper_output, a:msg.chunks)
+    " show the output right away, but leave insert mode alone (see the
+    " CursorHoldI note below); it'll be picked up on the next update
+    if mode() ==# 'n' && empty(timer_info(s:helper_timer))
+        let s:helper_timer = timer_start(0, function('s:helper_update'))
+    endif
+endfun
+
+fun! s:helper_update(timer)
+    python3 update_subchannel_msgs()
+endfun
+
 fun! <SID>toggle_send_on_save()
     if exists("s:ssos") && s:ssos == 0
         let s:ssos = 1
@@ -92,6 +157,58 @@ au FocusGained *.*,vim-ipython :python3 if update_subchannel_msgs(): echo("vim-i
 " displayed if vim-ipython buffer has been updated.
 au BufEnter vim-ipython :python3 if update_subchannel_msgs(): echo("vim-ipython shell updated (on buffer enter)",'Operator')
 
+" Debounced asynchronous completion, see g:ipy_async_complete above.
+augroup vim_ipython_complete
+    au!
+    au TextChangedI *.py call <SID>complete_debounce()
+    au InsertLeave *.py call <SID>complete_cancel()
+augroup END
+
+let s:complete_timer = get(s:, 'complete_timer', -1)
+let s:complete_poll_timer = get(s:, 'complete_poll_timer', -1)
+
+fun! <SID>complete_debounce()
+    if !g:ipy_async_complete || pumvisible()
+        return
+    endif
+    call timer_stop(s:complete_timer)
+    let s:complete_timer = timer_start(g:ipy_complete_delay,
+                \ function('s:complete_request'))
+endfun
+
+fun! <SID>complete_cancel()
+    call timer_stop(s:complete_timer)
+    call timer_stop(s:complete_poll_timer)
+    python3 complete_cancel()
+endfun
+
+fun! s:complete_request(timer)
+    if mode() !=# 'i'
+        return
+    endif
+    " locate the start of the word, as CompleteIPython does
+    let line = getline('.')
+    let col = col('.')
+    let start = col - 1
+    while start > 0 && line[start-1] =~ '\k\|\.'
+        let start -= 1
+    endwhile
+    let base = strpart(line, start, col - 1 - start)
+    if base !~ '\k'
+        return
+    endif
+    python3 complete_async(vim.eval('base'), vim.eval('line'), int(vim.eval('start')) + 1)
+    call timer_stop(s:complete_poll_timer)
+    let s:complete_poll_timer = timer_start(20,
+                \ function('s:complete_poll'), {'repeat': -1})
+endfun
+
+fun! s:complete_poll(timer)
+    if py3eval('complete_poll()')
+        call timer_stop(a:timer)
+    endif
+endfun
+
 " Setup plugin mappings for the most common ways to interact with ipython.
 noremap  <Plug>(IPython-Connect)                 : python3 km_from_string()<CR>
 noremap  <Plug>(IPython-RunLine)                 : python3 run_this_line()<CR>
@@ -157,12 +274,20 @@ if g:ipy_perform_mappings != 0
     " xnoremap <buffer> <silent> <M-C>      :s/^\([ \t]*\)#/\1/<CR>
 endif
 
-command! -nargs=* IPython :py3 km_from_string("<args>")
+command! -nargs=* -complete=customlist,IPythonKernelComplete IPython :py3 km_from_string("<args>")
 " command! -nargs=0 IPythonClipboard :py3 km_from_string(vim.eval('@+'))
 " command! -nargs=0 IPythonXSelection :py3 km_from_string(vim.eval('@*'))
 command! -nargs=* IPythonNew :py3 new_ipy("<args>")
 command! -nargs=* IPythonInterrupt :py3 interrupt_kernel_hack("<args>")
 command! -nargs=0 IPythonTerminate :py3 terminate_kernel_hack()
+command! -nargs=0 IPythonNamespace :py3 namespace_explorer()
+command! -nargs=? -complete=file IPythonRecord :py3 record_trace("<args>")
+
+" Complete :IPython's argument with the ids, kernel names and working
+" directories of running kernels.
+fun! IPythonKernelComplete(arglead, cmdline, cursorpos)
+    return py3eval('kernel_completions(vim.eval("a:arglead"))')
+endfun
 
 function! IPythonBalloonExpr()
 python << endpython
@@ -182,37 +307,20 @@ fun! CompleteIPython(findstart, base)
           let start -= 1
         endwhile
         echo start
-        python << endpython
+        python3 << endpython
 current_line = vim.current.line
 endpython
         return start
       else
         " find months matching with "a:base"
         let res = []
-        python << endpython
+        python3 << endpython
 base = vim.eval("a:base")
 findstart = vim.eval("a:findstart")
 matches = ipy_complete(base, current_line, vim.eval("col('.')"))
-# we need to be careful with unicode, because we can have unicode
-# completions for filenames (for the %run magic, for example). So the next
-# line will fail on those:
-#completions= [str(u) for u in matches]
-# because str() won't work for non-ascii characters
-# and we also have problems with unicode in vim, hence the following:
-completions = [s.encode(vim_encoding) for s in matches]
-## Additionally, we have no good way of communicating lists to vim, so we have
-## to turn in into one long string, which can be problematic if e.g. the
-## completions contain quotes. The next line will not work if some filenames
-## contain quotes - but if that's the case, the user's just asking for
-## it, right?
-#completions = '["'+ '", "'.join(completions)+'"]'
-#vim.command("let completions = %s" % completions)
-## An alternative for the above, which will insert matches one at a time, so
-## if there's a problem with turning a match into a string, it'll just not
-## include the problematic match, instead of not including anything. There's a
-## bit more indirection here, but I think it's worth it
-for c in completions:
-    vim.command('call add(res,"'+c+'")')
+# hand the list over as JSON, which vim reads as a list literal, so that
+# quotes and non-ascii characters (e.g. in %run filenames) survive
+vim.command("let res = %s" % json.dumps(matches, ensure_ascii=False))
 endpython
         "call extend(res,completions) 
         return res
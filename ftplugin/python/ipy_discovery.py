@@ -0,0 +1,278 @@
+"""
+Discovery of running kernels for :IPython.
+
+The connection files in jupyter's runtime directory are indexed, and each
+one is only read again when its mtime changes, so dozens of stale files
+don't slow down connecting. Whether a kernel is alive is checked by pinging
+the heartbeat ports of all candidates at once, and :IPython's argument picks
+among the live kernels by id, kernel name or working directory, preferring
+the closest match over the newest kernel.
+"""
+import glob
+import json
+import os
+import sys
+import time
+
+probe_timeout = 0.5  # seconds to wait for heartbeat replies
+probe_ttl = 5  # seconds a liveness result is reused for
+
+_index = {}  # connection file -> (mtime, kernel info)
+_probes = {}  # (connection file, mtime) -> (time probed, alive)
+
+
+def runtime_dir():
+    """where jupyter keeps the connection files of running kernels"""
+    try:
+        from jupyter_core.paths import jupyter_runtime_dir
+        return jupyter_runtime_dir()
+    except ImportError:  # e.g. vim's Python when g:ipy_use_helper is set
+        pass
+    if os.environ.get('JUPYTER_RUNTIME_DIR'):
+        return os.environ['JUPYTER_RUNTIME_DIR']
+    if sys.platform == 'darwin':
+        data = os.path.expanduser('~/Library/Jupyter')
+    elif os.name == 'nt':
+        data = os.path.join(os.environ.get('APPDATA', ''), 'jupyter')
+    else:
+        data = os.path.join(
+            os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share')),
+            'jupyter')
+    return os.path.join(os.environ.get('JUPYTER_DATA_DIR', data), 'runtime')
+
+
+def _read(path, mtime):
+    try:
+        with open(path) as f:
+            connection = json.load(f)
+    except (OSError, ValueError):
+        return None
+    name = os.path.basename(path)
+    return {
+        'path': path,
+        'mtime': mtime,
+        'id': name[len('kernel-'):-len('.json')],
+        'kernel_name': connection.get('kernel_name', ''),
+        'transport': connection.get('transport', 'tcp'),
+        'ip': connection.get('ip', '127.0.0.1'),
+        'hb_port': connection.get('hb_port'),
+        'cwd': None,
+    }
+
+
+def _find_cwds(kernels):
+    """
+    Fill in the working directory of kernels running on this machine, by
+    looking for the process that was given the connection file with -f,
+    as kernels are (clients such as ``jupyter console --existing`` name it
+    too, but aren't the kernel). Only possible where there is a /proc (i.e.
+    Linux).
+    """
+    wanted = dict((os.path.basename(k['path']), k) for k in kernels
+                  if k['cwd'] is None)
+    if not wanted or not os.path.isdir('/proc'):
+        return
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/%s/cmdline' % pid, 'rb') as f:
+                args = f.read().decode('utf-8', 'replace').split('\0')
+            for i, arg in enumerate(args):
+                if arg in ('-f', '--f') and i + 1 < len(args):
+                    connection_file = args[i + 1]
+                elif arg.startswith(('-f=', '--f=')):
+                    connection_file = arg.split('=', 1)[1]
+                else:
+                    continue
+                k = wanted.get(os.path.basename(connection_file))
+                if k is not None:
+                    k['cwd'] = os.readlink('/proc/%s/cwd' % pid)
+                    break
+        except OSError:  # gone already, or not ours to look at
+            continue
+    for k in wanted.values():
+        if k['cwd'] is None:
+            k['cwd'] = ''
+
+
+def index(directory=None):
+    """info on every connection file, newest first"""
+    directory = directory or runtime_dir()
+    kernels = []
+    seen = set()
+    for path in glob.glob(os.path.join(directory, 'kernel-*.json')):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        seen.add(path)
+        cached = _index.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _index[path] = (mtime, _read(path, mtime))
+        if cached[1] is not None:
+            kernels.append(cached[1])
+    for path in set(_index) - seen:
+        del _index[path]
+    _find_cwds(kernels)
+    kernels.sort(key=lambda k: k['mtime'], reverse=True)
+    return kernels
+
+
+def probe(kernels, timeout=None):
+    """
+    The kernels that answer on their heartbeat port. All of them are pinged
+    at once, so this takes at most ``timeout`` seconds however many there
+    are. Results are reused for probe_ttl seconds.
+    """
+    import zmq
+    timeout = probe_timeout if timeout is None else timeout
+    now = time.time()
+    result = {}
+    sockets = {}
+    context = zmq.Context.instance()
+    poller = zmq.Poller()
+    for k in kernels:
+        key = (k['path'], k['mtime'])
+        if key in _probes and now - _probes[key][0] < probe_ttl:
+            result[key] = _probes[key][1]
+            continue
+        result[key] = False
+        if k['hb_port'] is None:
+            continue
+        ip = k['ip'] if k['ip'] not in ('', '0.0.0.0') else '127.0.0.1'
+        if k['transport'] == 'tcp':
+            address = 'tcp://%s:%s' % (ip, k['hb_port'])
+        else:
+            address = '%s://%s-%s' % (k['transport'], ip, k['hb_port'])
+        socket = context.socket(zmq.REQ)
+        socket.linger = 0
+        socket.connect(address)
+        socket.send(b'ping')
+        poller.register(socket, zmq.POLLIN)
+        sockets[socket] = key
+    deadline = now + timeout
+    waiting = len(sockets)
+    while waiting:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        for socket, _ in poller.poll(remaining * 1000):
+            socket.recv()
+            poller.unregister(socket)
+            result[sockets[socket]] = True
+            waiting -= 1
+    for socket, key in sockets.items():
+        socket.close()
+        _probes[key] = (now, result[key])
+    return [k for k in kernels if result[(k['path'], k['mtime'])]]
+
+
+def rank(kernel, pattern):
+    """
+    How well ``pattern`` picks the kernel, lower is better, or None if it
+    doesn't match at all. Absolute paths (see pattern_from_args) only match
+    the connection file, the working directory or a directory above it.
+    Otherwise an exact or prefix match on the id beats the kernel name, which
+    beats the last part of the working directory, which beats the pattern
+    merely occurring in any of them.
+    """
+    if not pattern:
+        return 0
+    cwd = kernel['cwd'] or ''
+    if os.path.isabs(pattern):
+        if pattern == kernel['path'] or pattern == cwd:
+            return 0
+        if cwd.startswith(pattern.rstrip(os.sep) + os.sep):
+            return 1
+        return None
+    if kernel['id'] == pattern:
+        return 0
+    if kernel['id'].startswith(pattern):
+        return 1
+    if kernel['kernel_name'] == pattern:
+        return 2
+    if cwd and os.path.basename(cwd) == pattern:
+        return 3
+    if pattern in kernel['id'] or pattern in kernel['kernel_name'] or \
+            pattern in cwd:
+        return 4
+    return None
+
+
+def matches(kernel, pattern):
+    """does ``pattern`` pick the kernel at all (see rank)"""
+    return rank(kernel, pattern) is not None
+
+
+def candidates(kernels, pattern):
+    """
+    The kernels ``pattern`` matches, best match first. ``kernels`` is newest
+    first (as from index) and the sort is stable, so the newest come first
+    among equally good matches.
+    """
+    ranked = [(rank(k, pattern), k) for k in kernels]
+    ranked = [(r, k) for r, k in ranked if r is not None]
+    ranked.sort(key=lambda rk: rk[0])
+    return [k for r, k in ranked]
+
+
+def pattern_from_args(s):
+    """
+    The kernel pattern from :IPython's arguments, ignoring flags such as
+    --existing from old style connection strings.
+    """
+    words = [w for w in s.split() if not w.startswith('-')]
+    if not words:
+        return ''
+    pattern = words[0]
+    # 'kernel-1234.json', as printed by %connect_info, means id 1234
+    if pattern.startswith('kernel-') and pattern.endswith('.json'):
+        pattern = pattern[len('kernel-'):-len('.json')]
+    # paths are compared with the absolute working directories (and
+    # connection file paths) of the kernels
+    elif pattern.startswith(('~', '.')) or os.sep in pattern or \
+            (os.altsep and os.altsep in pattern):
+        pattern = os.path.abspath(os.path.expanduser(pattern))
+    return pattern
+
+
+def find(s=''):
+    """
+    The best matching live kernel for :IPython's arguments ``s`` (the newest
+    among equally good ones, see rank), or None. An explicit path to a
+    connection file is used as is.
+    """
+    pattern = pattern_from_args(s)
+    if pattern and os.path.isfile(pattern):
+        path = os.path.abspath(pattern)
+        return _read(path, os.stat(path).st_mtime)
+    live = probe(candidates(index(), pattern))
+    return live[0] if live else None
+
+
+def completions(arglead):
+    """
+    Candidates for completing :IPython's argument: ids, kernel names and
+    working directories of the indexed kernels, leaving out those known to
+    be dead. Nothing is probed, so this stays instant.
+    """
+    now = time.time()
+    words = []
+    for k in index():
+        known = _probes.get((k['path'], k['mtime']))
+        if known is not None and now - known[0] < probe_ttl and not known[1]:
+            continue
+        words.extend([k['id'], k['kernel_name'], k['cwd']])
+    seen = set()
+    return [w for w in words if w and w.startswith(arglead) and
+            not (w in seen or seen.add(w))]
+
+
+def describe(kernel):
+    text = 'kernel %s' % kernel['id']
+    if kernel['kernel_name']:
+        text += ' (%s)' % kernel['kernel_name']
+    if kernel['cwd']:
+        text += ' in %s' % kernel['cwd']
+    return text
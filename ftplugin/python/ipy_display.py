@@ -0,0 +1,201 @@
+"""
+On-disk cache for the rich parts of display_data and execute_result messages.
+
+Images, HTML and the like can't be shown in the vim-ipython shell, so each of
+them is written to a file and the shell gets a one line placeholder with the
+file's path instead. The placeholder is named after the message the data came
+in, so nothing has to be done to the payload before the line can be shown.
+Hashing, decoding and writing all happen on a background thread: the data is
+stored once in a file named after a hash of its content (a plot that's
+displayed twice is only stored once) and the placeholder's path is a hard
+link to it, or where there are no hard links, a small .link file next to it
+names the content file (see resolve). The least recently used files are
+removed once the cache grows past its size limit.
+"""
+import base64
+import hashlib
+import itertools
+import os
+import re
+import threading
+import time
+from queue import Queue
+
+# file extensions for the MIME types that can be cached
+extensions = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/svg+xml': '.svg',
+    'application/pdf': '.pdf',
+    'text/html': '.html',
+    'text/latex': '.tex',
+    'text/markdown': '.md',
+}
+
+# these arrive base64 encoded
+binary_types = set(['image/png', 'image/jpeg', 'image/gif', 'application/pdf'])
+
+default_types = ['image/png', 'image/jpeg', 'image/gif', 'image/svg+xml',
+                 'text/html']
+
+# seconds after which a .part file is taken to be left behind by a process
+# that died while writing it
+part_max_age = 600
+
+
+def default_directory():
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'vim-ipython', 'display')
+
+
+def resolve(path):
+    """
+    The file a placeholder's ``path`` stands for: the path itself or the
+    content file its .link file names, or None if there's neither (yet).
+    """
+    if os.path.exists(path):
+        return path
+    try:
+        with open(path + '.link', encoding='utf-8') as f:
+            target = os.path.join(os.path.dirname(path), f.read().strip())
+    except OSError:
+        return None
+    return target if os.path.exists(target) else None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:  # e.g. another vim or helper removed it first
+        pass
+
+
+# for messages without a msg_id
+_anonymous = itertools.count()
+
+
+class DisplayCache(object):
+    """
+    Content-addressed store for display data. ``store`` returns the path the
+    data will be available at right away and leaves all the work, hashing
+    included, to a worker thread.
+    """
+
+    def __init__(self, directory=None, max_bytes=100 * 1024**2, types=None):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.types = [t for t in (types or default_types) if t in extensions]
+        self._queue = Queue()
+        self._worker = None
+
+    def path_for(self, mimetype, data):
+        digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + extensions[mimetype])
+
+    def store(self, mimetype, data, key):
+        """
+        Queue ``data`` to be written, returning the path it will be linked
+        to. ``key`` names that path and must be unique to the data, e.g. the
+        msg_id of the message it came in plus its index in the bundle.
+        """
+        key = re.sub(r'[^\w.-]', '_', key)
+        path = os.path.join(self.directory, key + extensions[mimetype])
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work)
+            self._worker.daemon = True
+            self._worker.start()
+        self._queue.put((path, mimetype, data))
+        return path
+
+    def placeholders(self, bundle, msg_id=None):
+        """placeholder lines for the cacheable entries of a MIME bundle"""
+        if not msg_id:
+            msg_id = 'anonymous-%d-%d' % (os.getpid(), next(_anonymous))
+        mimetypes = [t for t in self.types if t in bundle]
+        return [
+            '[%s] %s' % (mimetype, self.store(mimetype, bundle[mimetype],
+                                              '%s-%d' % (msg_id, i)))
+            for i, mimetype in enumerate(mimetypes)
+        ]
+
+    def _work(self):
+        while True:
+            path, mimetype, data = self._queue.get()
+            try:
+                content = self.path_for(mimetype, data)
+                self._write(content, mimetype, data)
+                self._link(content, path)
+                if self._queue.empty():
+                    self.prune()
+            except (OSError, ValueError):
+                # a full disk or a broken payload shouldn't stop the worker,
+                # the placeholder will simply point at a missing file
+                pass
+
+    def _write(self, path, mimetype, data):
+        try:
+            os.utime(path, None)  # used again, so it's the newest now
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.directory, exist_ok=True)
+        if mimetype in binary_types:
+            content = base64.b64decode(data)
+        else:
+            content = data.encode('utf-8')
+        partial = path + '.part'
+        with open(partial, 'wb') as f:
+            f.write(content)
+        os.replace(partial, path)
+
+    def _link(self, content, path):
+        partial = path + '.part'
+        _remove(partial)
+        try:
+            os.link(content, partial)
+        except OSError:
+            # no hard links on this file system: rather than storing the
+            # data twice, note which file it is in
+            with open(partial, 'w', encoding='utf-8') as f:
+                f.write(os.path.basename(content))
+            os.replace(partial, path + '.link')
+            return
+        os.replace(partial, path)
+
+    def prune(self):
+        """remove the least recently used files until the cache fits"""
+        # other vims and helpers share the directory, so any file may be
+        # gone by the time it's looked at
+        now = time.time()
+        files = {}
+        links = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.part'):
+                if now - st.st_mtime > part_max_age:
+                    _remove(path)
+                continue
+            if name.endswith('.link'):
+                links.append(path)
+                continue
+            # a file and the placeholder paths linked to it go together
+            entry = files.setdefault((st.st_dev, st.st_ino),
+                                     [st.st_mtime, st.st_size, []])
+            entry[2].append(name)
+        total = sum(size for _, size, _ in files.values())
+        for _, size, names in sorted(files.values()):
+            if total <= self.max_bytes:
+                break
+            for name in names:
+                _remove(os.path.join(self.directory, name))
+            total -= size
+        # and so do .link files and the file they name
+        for path in links:
+            if resolve(path[:-len('.link')]) is None:
+                _remove(path)
@@ -0,0 +1,164 @@
+"""
+Out-of-process client for vim-ipython.
+
+When g:ipy_use_helper is set, vim starts this script with job_start() in JSON
+channel mode (see IPythonHelperStart in ipy.vim). It owns the jupyter_client
+connection, so the Python that vim is linked against needn't have
+jupyter_client installed, and all zmq I/O, polling and JSON decoding happens
+here rather than in vim. iopub messages are rendered here too, so vim only
+has to append the resulting lines to the vim-ipython shell.
+
+Requests arrive on stdin as ``[id, {"cmd": ..., ...}]`` and are answered with
+``[id, {"result": ...}]`` or ``[id, {"error": ...}]``. Rendered iopub output
+is pushed to vim as ``[0, {"event": "iopub", "chunks": [...]}]``.
+"""
+import json
+import sys
+import threading
+from queue import Empty, Queue
+
+import ipy_discovery
+from ipy_display import DisplayCache
+from ipy_messages import compact_msg, render_msg
+from ipy_trace import TraceRecorder
+
+poll_interval = 0.05  # seconds between checks of the iopub channel
+
+
+class Helper(object):
+    """Answers requests from vim and forwards iopub output to it"""
+
+    def __init__(self, out):
+        self.out = out
+        self.kernel = None
+        self.kc = None
+        self.prompt_in = 'In [%(line)d]: '
+        self.prompt_out = 'Out[%(line)d]: '
+        self.display = DisplayCache()
+        self.recorder = None
+
+    def write(self, msg):
+        self.out.write(json.dumps(msg, default=str) + '\n')
+        self.out.flush()
+
+    def handle(self, msg_id, request):
+        try:
+            cmd = request.pop('cmd')
+            if self.kc is None and cmd not in ('connect', 'new', 'record'):
+                raise RuntimeError('not connected to IPython')
+            result = getattr(self, 'do_' + cmd)(**request)
+        except Exception as e:
+            reply = {'error': '%s: %s' % (type(e).__name__, e)}
+        else:
+            reply = {'result': result}
+        self.write([msg_id, reply])
+
+    def _start(self, use_exist, connection_file=None, prompt_in=None,
+               prompt_out=None, display_cache=None, display_cache_size=None,
+               display_types=None):
+        from simple_kernel import SimpleKernel
+        # keep the SimpleKernel around, its kernel manager goes with it
+        self.kernel = SimpleKernel(use_exist=use_exist,
+                                   connection_file=connection_file)
+        self.kc = self.kernel.client
+        self.prompt_in = prompt_in or self.prompt_in
+        self.prompt_out = prompt_out or self.prompt_out
+        if display_cache_size is not None:
+            self.display = DisplayCache(display_cache, display_cache_size,
+                                        display_types)
+        return True
+
+    def do_connect(self, args='', **settings):
+        kernel_info = ipy_discovery.find(args)
+        if kernel_info is None:
+            raise RuntimeError('no running kernel matches %r' % args)
+        self._start(True, kernel_info['path'], **settings)
+        return ipy_discovery.describe(kernel_info)
+
+    def do_new(self, args='', **settings):
+        return self._start(False, **settings)
+
+    def do_execute(self, code, silent=0, store_history=1,
+                   user_expressions=None):
+        msg_id = self.kc.execute(code, silent=bool(silent),
+                                 store_history=bool(store_history),
+                                 user_expressions=user_expressions or {})
+        if self.recorder is not None:
+            self.recorder.request('execute_request', msg_id)
+        return msg_id
+
+    def do_complete(self, code, cursor_pos=None):
+        msg_id = self.kc.complete(code, cursor_pos)
+        if self.recorder is not None:
+            self.recorder.request('complete_request', msg_id)
+        return msg_id
+
+    def do_shell(self, timeout=1):
+        try:
+            m = self.kc.get_shell_msg(timeout=timeout)
+        except Empty:
+            return None
+        if self.recorder is not None:
+            self.recorder.record('shell', m)
+        return compact_msg(m)
+
+    def do_record(self, path=''):
+        stopped = None
+        if self.recorder is not None:
+            self.recorder.close()
+            stopped, self.recorder = self.recorder.path, None
+        if path:
+            self.recorder = TraceRecorder(path)
+        return stopped
+
+    def forward_iopub(self):
+        if self.kc is None:
+            return
+        msgs = self.kc.iopub_channel.get_msgs()
+        if self.recorder is not None:
+            for m in msgs:
+                self.recorder.record('iopub', m)
+        chunks = [
+            render_msg(m, self.prompt_in, self.prompt_out, self.display)
+            for m in msgs
+        ]
+        chunks = [s for s in chunks if s is not None]
+        if chunks:
+            self.write([0, {'event': 'iopub', 'chunks': chunks}])
+
+
+def read_requests(stream, requests):
+    """queue up requests from vim; None marks the end of input"""
+    for line in stream:
+        line = line.strip()
+        if line:
+            requests.put(json.loads(line))
+    requests.put(None)
+
+
+def main():
+    out = sys.stdout
+    # anything else printing to stdout would corrupt the channel
+    sys.stdout = sys.stderr
+    helper = Helper(out)
+    requests = Queue()
+    reader = threading.Thread(target=read_requests,
+                              args=(sys.stdin, requests))
+    reader.daemon = True
+    reader.start()
+    while True:
+        try:
+            request = requests.get(timeout=poll_interval)
+        except Empty:
+            request = ()
+        if request is None:
+            break
+        if request:
+            helper.handle(*request)
+        helper.forward_iopub()
+    if helper.recorder is not None:
+        helper.recorder.close()
+
+
+if __name__ == '__main__':
+    main()
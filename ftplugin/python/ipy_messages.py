@@ -0,0 +1,112 @@
+"""
+Handling of kernel messages that doesn't need vim.
+
+This is shared by vim_ipython.py, which runs inside vim, and ipy_helper.py,
+which runs as a separate process when g:ipy_use_helper is set.
+"""
+import re
+import time
+
+# from http://serverfault.com/questions/71285/in-centos-4-4-how-can-i-strip-escape-sequences-from-a-text-file
+strip = re.compile('\x1B\[([0-9]{1,2}(;[0-9]{1,2})?)?[m|K]')
+
+
+def strip_color_escapes(s):
+    """replace special characters
+    """
+    return strip.sub('', s)
+
+
+def render_msg(m, prompt_in, prompt_out, display=None):
+    """
+    Render an iopub message as text for the vim-ipython shell. Returns None
+    for messages that aren't shown there.
+
+    Rich display data (images, HTML, ...) is handed to ``display``, an
+    ipy_display.DisplayCache, and shows up as placeholder lines. Without a
+    cache only the text/plain part is shown.
+    """
+    if 'msg_type' not in m['header']:
+        # debug information
+        # echo('skipping a message on sub_channel','WarningMsg')
+        # echo(str(m))
+        return None
+    s = ''
+    header = m['header']['msg_type']
+    if header == 'status':
+        return None
+    elif header == 'stream':
+        # TODO: alllow for distinguishing between stdout and stderr (using
+        # custom syntax markers in the vim-ipython buffer perhaps), or by
+        # also echoing the message to the status bar
+        try:
+            s = strip_color_escapes(m['content']['data'])
+        except KeyError:  # changed in IPython 3.0.0
+            s = strip_color_escapes(m['content']['text'])
+    elif header == 'pyout' or header == 'execute_result':
+        s = prompt_out % {'line': m['content']['execution_count']}
+        s += _render_bundle(m, display)
+    elif header == 'display_data':
+        s += _render_bundle(m, display)
+    elif header == 'pyin' or header == 'execute_input':
+        # TODO: the next line allows us to resend a line to ipython if
+        # %doctest_mode is on. In the future, IPython will send the
+        # execution_count on subchannel, so this will need to be updated
+        # once that happens
+        line_number = m['content'].get('execution_count', 0)
+        prompt = prompt_in % {'line': line_number}
+        s = prompt
+        # add a continuation line (with trailing spaces if the prompt has them)
+        dots = '.' * len(prompt.rstrip())
+        dots += prompt[len(prompt.rstrip()):]
+        s += m['content']['code'].rstrip().replace('\n', '\n' + dots)
+    elif header == 'pyerr' or header == 'error':
+        c = m['content']
+        s = "\n".join(map(strip_color_escapes, c['traceback']))
+        s += c['ename'] + ":" + c['evalue']
+    return s
+
+
+def _render_bundle(m, display):
+    """text/plain of a message's MIME bundle, then placeholders for the rest"""
+    data = m['content']['data']
+    lines = [data['text/plain']] if 'text/plain' in data else []
+    if display is not None:
+        lines.extend(display.placeholders(data, m['header'].get('msg_id')))
+    return '\n'.join(lines)
+
+
+def compact_msg(m):
+    """
+    Keep only the parts of a message that vim-ipython looks at, as plain
+    JSON-serializable data (headers carry datetime objects).
+    """
+    return {
+        'header': {
+            'msg_id': m['header'].get('msg_id'),
+            'msg_type': m['header'].get('msg_type'),
+        },
+        'parent_header': {
+            'msg_id': m['parent_header'].get('msg_id'),
+        },
+        'content': m['content'],
+    }
+
+
+def wait_for_reply(get_msg, msg_id, timeout=1):
+    """
+    Read messages with ``get_msg(timeout=...)`` (e.g. a client's
+    get_shell_msg) until the reply to ``msg_id`` comes in. Messages in
+    between are dropped. Raises queue.Empty if the reply doesn't arrive
+    within ``timeout`` seconds.
+    """
+    deadline = time.time() + timeout
+    while True:
+        # get_msg will raise with Empty exception if no messages arrive before
+        # the deadline
+        m = get_msg(timeout=max(deadline - time.time(), 0))
+        if m['parent_header'].get('msg_id') == msg_id:
+            return m
+        # else:
+        # got a message, but not the one we were looking for
+        # echo('skipping a message on shell_channel', 'WarningMsg')
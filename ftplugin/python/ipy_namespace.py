@@ -0,0 +1,135 @@
+"""
+Kernel namespace summaries for the vim-ipython namespace explorer.
+
+``kernel_code`` is sent along with every refresh as a silent execute. It
+defines ``_vim_ipython_ns`` in the kernel (only the first time), which keeps
+a compact summary of each user variable (type, shape or length and
+approximate size in bytes) together with the version at which that summary
+last changed. A refresh asks, through ``user_expressions``, for the entries
+that changed since the version the client has already seen, so the reply
+stays small however many names or how large the arrays are.
+"""
+import ast
+import json
+
+kernel_code = '''
+try:
+    _vim_ipython_ns
+except NameError:
+    def _vim_ipython_ns_factory():
+        import binascii, json, os, sys
+        sized = (str, bytes, list, tuple, dict, set, frozenset)
+        plain = sized + (int, float, complex, bool, type(None))
+        state = {
+            'token': binascii.hexlify(os.urandom(8)).decode(),
+            'version': 0,
+            'entries': {},  # name -> (summary, version it last changed)
+            'removed': {},  # name -> version it was removed
+        }
+
+        def summarize(obj):
+            shape = getattr(obj, 'shape', None)
+            if isinstance(shape, tuple):
+                length = 'x'.join(str(n) for n in shape)
+            elif isinstance(obj, sized):
+                length = str(len(obj))
+            else:
+                length = ''
+            nbytes = getattr(obj, 'nbytes', None)
+            if not isinstance(nbytes, int):
+                # only ask cheap objects for their size, __sizeof__ can be
+                # expensive (e.g. deep memory usage of DataFrames)
+                nbytes = sys.getsizeof(obj) if isinstance(obj, plain) else -1
+            return [type(obj).__name__, length, nbytes]
+
+        def namespace(since, token):
+            ip = get_ipython()
+            hidden = ip.user_ns_hidden
+            entries, removed = state['entries'], state['removed']
+            version = state['version'] + 1
+            changed = False
+            current = set()
+            for name, obj in list(ip.user_ns.items()):
+                if name.startswith('_') or name in hidden:
+                    continue
+                current.add(name)
+                try:
+                    summary = summarize(obj)
+                except Exception:
+                    summary = [type(obj).__name__, '', -1]
+                old = entries.get(name)
+                if old is None or old[0] != summary:
+                    entries[name] = (summary, version)
+                    removed.pop(name, None)
+                    changed = True
+            for name in list(entries):
+                if name not in current:
+                    del entries[name]
+                    removed[name] = version
+                    changed = True
+            if changed:
+                state['version'] = version
+            full = token != state['token'] or since > state['version']
+            if full:
+                since = 0
+            return json.dumps({
+                'token': state['token'],
+                'version': state['version'],
+                'full': full,
+                'changed': dict((n, e[0]) for n, e in entries.items()
+                                if e[1] > since),
+                'removed': [n for n, v in removed.items() if v > since],
+            })
+
+        return namespace
+
+    _vim_ipython_ns = _vim_ipython_ns_factory()
+    del _vim_ipython_ns_factory
+'''
+
+
+def request_expression(version, token):
+    """the user_expression asking for the changes since ``version``"""
+    return '_vim_ipython_ns(%d, %r)' % (version, str(token))
+
+
+def parse_reply(result):
+    """decode the user_expressions result, raises RuntimeError on failure"""
+    if result.get('status') != 'ok':
+        raise RuntimeError('%s: %s' % (result.get('ename', 'Error'),
+                                       result.get('evalue', '')))
+    return json.loads(ast.literal_eval(result['data']['text/plain']))
+
+
+def apply_update(table, update):
+    """merge a reply into ``table``, a dict of name -> summary"""
+    if update['full']:
+        table.clear()
+    for name in update['removed']:
+        table.pop(name, None)
+    table.update(update['changed'])
+    return table
+
+
+def format_size(nbytes):
+    if nbytes < 0:
+        return '?'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if nbytes < 1024 or unit == 'GB':
+            break
+        nbytes /= 1024.0
+    return ('%d %s' if unit == 'B' else '%.1f %s') % (nbytes, unit)
+
+
+def format_table(table):
+    """lines for the namespace buffer, one per name, sorted by name"""
+    rows = [('name', 'type', 'shape/len', 'size')]
+    for name in sorted(table):
+        kind, length, nbytes = table[name]
+        rows.append((name, kind, length, format_size(nbytes)))
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    return [
+        '%-*s  %-*s  %-*s  %s' % (widths[0], row[0], widths[1], row[1],
+                                  widths[2], row[2], row[3])
+        for row in rows
+    ]
@@ -0,0 +1,237 @@
+"""
+Replay traces of kernel messages (see ipy_trace.py) without a kernel or vim.
+
+The iopub messages go through the same rendering as the vim-ipython shell
+and the shell messages through the same reply matching as get_child_msg, so
+a change to either can be checked for correctness (``--render`` prints the
+shell's text, to diff against an earlier version) and speed (the default,
+which reports lines per second and peak memory).
+
+    python ipy_replay.py TRACE [TRACE ...] [--repeat N] [--display]
+    python ipy_replay.py --render TRACE
+    python ipy_replay.py --synthetic heavy.jsonl.gz
+
+``--synthetic`` writes a trace of the heavy cases that are slow to render: a
+huge traceback, a progress bar and a big DataFrame repr.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from queue import Empty
+
+import ipy_trace
+from ipy_display import DisplayCache
+from ipy_messages import render_msg, wait_for_reply
+
+prompt_in = 'In [%(line)d]: '
+prompt_out = 'Out[%(line)d]: '
+
+
+def render(trace, display=None):
+    """the lines the vim-ipython shell would show for the trace's iopub part"""
+    lines = []
+    for entry in trace:
+        if entry['channel'] != 'iopub':
+            continue
+        s = render_msg(entry['msg'], prompt_in, prompt_out, display)
+        if s is None:
+            continue
+        # appended the way update_subchannel_msgs does it
+        lines.extend(s.splitlines() if '\n' in s else [s])
+    return lines
+
+
+def match_replies(trace):
+    """
+    Wait for the reply to every request recorded in the trace, in the order
+    they were sent, as get_child_msg would. Returns a dict with the number of
+    replies ``found`` out of the ``wanted`` requests, the parent msg_ids of
+    the replies ``dropped`` on the way (e.g. to stale completion requests)
+    and the msg_ids of the requests whose reply is ``missing``.
+    """
+    requests = [e['msg']['header']['msg_id'] for e in trace
+                if e['channel'] == 'request']
+    shell = deque(e['msg'] for e in trace if e['channel'] == 'shell')
+    skipped = []
+
+    def get_msg(timeout=None):
+        if not shell:
+            raise Empty
+        m = shell.popleft()
+        skipped.append(m)
+        return m
+
+    found = 0
+    dropped = []
+    missing = []
+    for msg_id in requests:
+        del skipped[:]
+        try:
+            wait_for_reply(get_msg, msg_id, timeout=0)
+        except Empty:
+            missing.append(msg_id)
+            # the replies read while waiting may belong to later requests
+            shell.extendleft(reversed(skipped))
+            continue
+        found += 1
+        dropped.extend(m['parent_header'].get('msg_id') for m in skipped[:-1])
+    # nothing waited for these
+    dropped.extend(m['parent_header'].get('msg_id') for m in shell)
+    return {
+        'found': found,
+        'wanted': len(requests),
+        'dropped': dropped,
+        'missing': missing,
+    }
+
+
+def measure(trace, repeat=1, display=None):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        lines = render(trace, display)
+    render_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        replies = match_replies(trace)
+    match_time = time.perf_counter() - start
+
+    # separately, tracemalloc slows everything down
+    tracemalloc.start()
+    render(trace, display)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'lines': len(lines) * repeat,
+        'render_time': render_time,
+        'peak': peak,
+        'replies': replies,
+        'match_time': match_time,
+    }
+
+
+def report(name, trace, stats):
+    iopub = sum(1 for e in trace if e['channel'] == 'iopub')
+    shell = sum(1 for e in trace if e['channel'] == 'shell')
+    print('%s: %d iopub and %d shell messages' % (name, iopub, shell))
+    print('  rendering: %d lines in %.3fs (%d lines/s), peak %.1f MB' %
+          (stats['lines'], stats['render_time'],
+           stats['lines'] / max(stats['render_time'], 1e-9),
+           stats['peak'] / 1024.0**2))
+    replies = stats['replies']
+    print('  reply matching: %d/%d replies in %.3fs' %
+          (replies['found'], replies['wanted'], stats['match_time']))
+    if replies['dropped']:
+        print('  dropped replies to: %s' %
+              ', '.join(map(str, replies['dropped'])))
+    if replies['missing']:
+        print('  no reply to: %s' % ', '.join(replies['missing']))
+
+
+def _msg(msg_type, content, msg_id, parent_id=None):
+    return {
+        'header': {'msg_id': msg_id, 'msg_type': msg_type},
+        'parent_header': {'msg_id': parent_id},
+        'content': content,
+    }
+
+
+def synthetic_trace():
+    """a trace with a huge traceback, a progress bar and a big DataFrame"""
+    entries = []
+
+    def add(channel, m):
+        entries.append({'channel': channel, 'time': 0, 'msg': m})
+
+    def cell(n, code, outputs):
+        request = 'request-%d' % n
+        add('request', _msg('execute_request', {}, request))
+        add('iopub', _msg('status', {'execution_state': 'busy'},
+                          'busy-%d' % n, request))
+        add('iopub', _msg('execute_input',
+                          {'code': code, 'execution_count': n},
+                          'input-%d' % n, request))
+        for i, (msg_type, content) in enumerate(outputs):
+            add('iopub', _msg(msg_type, content, 'out-%d-%d' % (n, i), request))
+        add('iopub', _msg('status', {'execution_state': 'idle'},
+                          'idle-%d' % n, request))
+        add('shell', _msg('execute_reply',
+                          {'status': 'ok', 'execution_count': n},
+                          'reply-%d' % n, request))
+
+    frames = []
+    for i in range(2000):
+        frames.append(
+            '\x1b[0;32m/usr/lib/python3/site-packages/module%d.py\x1b[0m in '
+            '\x1b[0;36mfunction%d\x1b[0;34m(x)\x1b[0m\n'
+            '\x1b[0;32m---> %d\x1b[0;31m     return function%d(x + 1)\x1b[0m'
+            % (i, i, i + 10, i + 1))
+    cell(1, 'function0(0)', [('error', {
+        'ename': 'RecursionError',
+        'evalue': 'maximum recursion depth exceeded',
+        'traceback': frames,
+    })])
+
+    progress = []
+    for i in range(5000):
+        done = i * 50 // 4999
+        progress.append(('stream', {
+            'name': 'stderr',
+            'text': '\r%3d%%|%s%s| %d/5000' % (i * 100 // 4999, '#' * done,
+                                                ' ' * (50 - done), i + 1),
+        }))
+    cell(2, 'for i in tqdm(range(5000)): step(i)', progress)
+
+    rows = ['      ' + ''.join('%12s' % ('col%d' % c) for c in range(20))]
+    for r in range(10000):
+        rows.append('%-6d' % r + ''.join('%12.4f' % (r * 0.001 * c)
+                                         for c in range(20)))
+    cell(3, 'df', [('execute_result', {
+        'execution_count': 3,
+        'data': {'text/plain': '\n'.join(rows)},
+    })])
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='replay vim-ipython kernel message traces')
+    parser.add_argument('traces', nargs='*', help='trace files to replay')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='replay each trace this many times')
+    parser.add_argument('--render', action='store_true',
+                        help="print the vim-ipython shell's text instead")
+    parser.add_argument('--display', action='store_true',
+                        help='also write rich display data to a scratch '
+                        'display cache')
+    parser.add_argument('--synthetic', metavar='TRACE',
+                        help='write a trace of heavy output to TRACE')
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        ipy_trace.save(args.synthetic, synthetic_trace())
+    display = None
+    if args.display:
+        scratch = tempfile.mkdtemp(prefix='vim-ipython-replay-')
+        display = DisplayCache(scratch)
+    try:
+        for path in args.traces:
+            trace = ipy_trace.load(path)
+            if args.render:
+                for line in render(trace, display):
+                    print(line)
+            else:
+                report(os.path.basename(path), trace,
+                       measure(trace, args.repeat, display))
+    finally:
+        if display is not None:
+            shutil.rmtree(display.directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Traces of the kernel messages vim-ipython receives.
+
+A trace is a file with one JSON object per line, ``{"channel": "iopub",
+"shell" or "request", "time": seconds since the recording started, "msg":
+...}``, where the message is cut down by ipy_messages.compact_msg. "request"
+entries are the execute and complete requests vim-ipython sent, with only
+their msg_id and msg_type, so that replay can tell which replies were waited
+for. Files whose name ends in .gz are gzip compressed. :IPythonRecord writes them, ipy_replay.py reads them.
+"""
+import gzip
+import json
+import time
+
+from ipy_messages import compact_msg
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class TraceRecorder(object):
+    """appends the messages passed to ``record`` to a trace file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.time()
+        self._file = _open(path, 'w')
+
+    def record(self, channel, m):
+        entry = {
+            'channel': channel,
+            'time': round(time.time() - self.start, 3),
+            'msg': compact_msg(m),
+        }
+        self._file.write(json.dumps(entry, default=str) + '\n')
+
+    def request(self, msg_type, msg_id):
+        """record that a request (e.g. an execute_request) was sent"""
+        self.record('request', {
+            'header': {'msg_id': msg_id, 'msg_type': msg_type},
+            'parent_header': {},
+            'content': {},
+        })
+
+    def close(self):
+        self._file.close()
+
+
+def load(path):
+    """the entries of a trace file, as a list"""
+    with _open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save(path, entries):
+    with _open(path, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
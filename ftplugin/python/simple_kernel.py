@@ -17,7 +17,7 @@ class SimpleKernel(object):
     )
     """
 
-    def __init__(self, use_exist=False):
+    def __init__(self, use_exist=False, connection_file=None):
         """
         ## Description
         Initializes the `kernel_manager` and `client` objects
@@ -26,16 +26,24 @@ class SimpleKernel(object):
         payloads.
 
         ## Parameters
-        None.
+        use_exist : bool (default=False)
+            Connect to a running kernel instead of starting one.
+        connection_file : string (default=None)
+            The running kernel's connection file. The most recent
+            one is used if not given.
         """
+        # only shut down kernels we started ourselves
+        self.owns_kernel = not use_exist
         if not use_exist:
             # Initialize kernel and client
             self.kernel_manager, self.client = start_new_kernel()
             self.send = self.client.execute
         else:
+            if connection_file is None:
+                connection_file = find_connection_file()
             self.kernel_manager = KernelManager(
-                connection_file=find_connection_file())
-            self.kernel_manager.load_connection_file(find_connection_file())
+                connection_file=connection_file)
+            self.kernel_manager.load_connection_file()
             self.client = self.kernel_manager.client()
             self.client.start_channels()
             self.send = self.client.execute
@@ -106,9 +114,10 @@ class SimpleKernel(object):
     def __del__(self):
         """
         ## Description
-        Destructor. Shuts down kernel safely.
+        Destructor. Shuts down kernel safely, if we started it.
         """
-        self.kernel_manager.shutdown_kernel()
+        if self.owns_kernel:
+            self.kernel_manager.shutdown_kernel()
 
 
 # end Simple Kernel #
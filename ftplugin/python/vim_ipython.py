@@ -1,6 +1,16 @@
+import atexit
+import json
+import os
 import re
+import time
 from queue import Empty
 
+import ipy_discovery
+import ipy_namespace
+from ipy_display import DisplayCache, resolve
+from ipy_messages import render_msg, strip_color_escapes, wait_for_reply
+from ipy_trace import TraceRecorder
+
 reselect = False  # reselect lines after sending from Visual mode
 show_execution_count = True  # wait to get numbers for In[43]: feedback?
 monitor_subchannel = True  # update vim-ipython 'shell' on every send?
@@ -49,6 +59,25 @@ status_prompt_colors = {
 
 status_blank_lines = int(vim_variable('g:ipy_status_blank_lines', '1'))
 
+# completion settings: how long (in ms) to wait for the kernel before falling
+# back to local completions, and how many kernel-supplied names to remember
+complete_timeout = int(vim_variable('g:ipy_complete_timeout', '300')) / 1000.0
+complete_cache_size = int(vim_variable('g:ipy_complete_cache_size', '2000'))
+
+# rich display data (images, HTML) is written to this cache and shown as
+# placeholders in the vim-ipython shell, <CR> on one opens it with
+# g:ipy_display_open (xdg-open or open, by default)
+display_cache = DisplayCache(
+    vim_variable('g:ipy_display_cache', ''),
+    int(vim_variable('g:ipy_display_cache_size', '100')) * 1024**2,
+    vim_variable('g:ipy_display_types', '').split(',') if
+    vim_variable('g:ipy_display_types') else None)
+display_opener = vim_variable('g:ipy_display_open', '')
+
+# selections longer than this many characters are written to a temporary file
+# and run from there with %run, instead of being sent inline (0 to disable)
+inline_max_size = int(vim_variable('g:ipy_inline_max_size', '65536'))
+
 # this allows us to load vim_ipython multiple times
 try:
     km
@@ -59,6 +88,27 @@ except NameError:
     kc = None
     pid = None
 
+# the in-flight asynchronous completion request and the names collected from
+# earlier completion replies (used as a fallback when the kernel is busy)
+_complete_request = None
+_complete_cache = []
+
+# the namespace explorer's table (name -> [type, shape/len, size]) and the
+# (token, version) of the kernel-side summaries it's up to date with
+_namespace = {}
+_namespace_version = ('', 0)
+
+# temporary files written by send_code, by the msg_id of the execute request
+# that runs them. Each one is removed once its execute_reply comes in (see
+# get_shell_msg), whatever is left over when vim exits.
+_sent_files = {}
+
+# the running :IPythonRecord trace, if any
+try:
+    _recorder
+except NameError:
+    _recorder = None
+
 _install_instructions = """You *must* install IPython into the Python that
 your vim is linked against. If you are seeing this message, this usually means
 either (1) installing IPython using the system Python that vim is using, or
@@ -67,9 +117,135 @@ installed. This is only a requirement to allow Vim to speak with an IPython
 instance using IPython's own machinery. It does *not* mean that the IPython
 instance with which you communicate via vim-ipython needs to be running the
 same version of Python.
+
+Alternatively, set g:ipy_use_helper to 1 and point g:ipy_helper_python at a
+Python that has jupyter_client installed. vim-ipython will then talk to the
+kernel through a helper process running that Python instead.
 """
 
 
+class HelperClient(object):
+    """
+    Stand-in for a jupyter_client KernelClient when g:ipy_use_helper is set.
+    Requests are forwarded to the ipy_helper.py process over its job channel,
+    and iopub output arrives from it already rendered (see IPythonHelperStart
+    in ipy.vim).
+
+    Once the helper has died every request raises Empty, which callers
+    already handle for a kernel that doesn't reply. The death itself is only
+    reported once.
+    """
+
+    def __init__(self):
+        self.dead = False
+
+    def _gone(self, message):
+        if not self.dead:
+            self.dead = True
+            echo("%s, see %s" % (message, vim.eval('g:ipy_helper_log')),
+                 'Error')
+        raise Empty
+
+    def _request(self, request, wait=1):
+        # a helper that died would make ch_evalexpr raise vim.error
+        if self.dead or vim.eval("job_status(g:ipy_helper_job)") != 'run':
+            self._gone("the vim-ipython helper is not running")
+        # go through json_decode/json_encode so that numbers and nested
+        # containers keep their types, which vim.eval would turn into strings
+        try:
+            reply = vim.eval(
+                "json_encode(ch_evalexpr(g:ipy_helper_job, json_decode('%s'), "
+                "{'timeout': %d}))" % (json.dumps(request).replace("'", "''"),
+                                       int(wait * 1000) + 500))
+        except vim.error:
+            self._gone("lost the vim-ipython helper")
+        reply = json.loads(reply)
+        if not reply:  # no answer before the channel timeout
+            raise Empty
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def start(self, cmd, args=''):
+        """connect to a kernel (cmd='connect') or start one (cmd='new')"""
+        return self._request({
+            'cmd': cmd,
+            'args': args,
+            'prompt_in': status_prompt_in,
+            'prompt_out': status_prompt_out,
+            'display_cache': display_cache.directory,
+            'display_cache_size': display_cache.max_bytes,
+            'display_types': display_cache.types,
+        }, wait=30)
+
+    def execute(self, code, silent=False, store_history=True,
+                user_expressions=None):
+        """returns the request's msg_id, raises Empty if it wasn't sent"""
+        try:
+            return self._request({
+                'cmd': 'execute',
+                'code': code,
+                'silent': int(silent),
+                'store_history': int(store_history),
+                'user_expressions': user_expressions or {},
+            })
+        except Empty:
+            if not self.dead:  # otherwise that has been reported
+                echo("no reply from the vim-ipython helper, see %s" %
+                     vim.eval('g:ipy_helper_log'), 'Error')
+            raise
+
+    def complete(self, code, cursor_pos=None):
+        return self._request({
+            'cmd': 'complete',
+            'code': code,
+            'cursor_pos': len(code) if cursor_pos is None else cursor_pos,
+        })
+
+    def get_shell_msg(self, timeout=1):
+        m = self._request({'cmd': 'shell', 'timeout': timeout}, wait=timeout)
+        if m is None:
+            raise Empty
+        return m
+
+    def record(self, path):
+        """
+        stop the running trace recording, if any, and start recording to
+        ``path`` unless it is empty; returns the stopped recording's path
+        """
+        return self._request({'cmd': 'record', 'path': path})
+
+    def get_output(self):
+        """rendered iopub output the helper has pushed since the last call"""
+        return vim.eval('IPythonHelperOutput()')
+
+
+def _helper_connect(cmd, s=''):
+    """
+    connect to (or start) a kernel through the helper process, returns what
+    the helper says about the kernel, or None if that failed
+    """
+    global km, kc
+    if not int(vim.eval('IPythonHelperStart()')):
+        echo("could not start the vim-ipython helper using %s, see %s" %
+             (vim.eval('g:ipy_helper_python'), vim.eval('g:ipy_helper_log')),
+             'Error')
+        return None
+    client = HelperClient()
+    try:
+        result = client.start(cmd, s)
+    except Empty:
+        echo("no reply from the vim-ipython helper, see %s" %
+             vim.eval('g:ipy_helper_log'), 'Error')
+        return None
+    except RuntimeError as e:
+        echo("vim-ipython helper: %s" % e, 'Error')
+        return None
+    km = None
+    kc = client
+    return result
+
+
 def new_ipy(s=''):
     """Create a new IPython kernel (optionally with extra arguments)
 
@@ -81,36 +257,66 @@ def new_ipy(s=''):
         new_ipy()
 
     """
-    from simple_kernel import SimpleKernel
+    global km, kc
 
-    kernel = SimpleKernel(use_exist=False)
+    if int(vim_variable('g:ipy_use_helper', '0')):
+        _helper_connect('new', s)
+        return km
+    try:
+        from simple_kernel import SimpleKernel
+    except ImportError:
+        echo("could not import jupyter_client, see :messages", 'Error')
+        print(_install_instructions)
+        return
 
-    global km, kc, send
+    kernel = SimpleKernel(use_exist=False)
 
     km = kernel.kernel_manager
     kc = kernel.client
-    send = kernel.send
 
     return km
 
 
 def km_from_string(s=''):
     """create kernel manager from existing jupyter kernel
+
+    ``s`` picks the kernel: part of its id, kernel name or working directory,
+    or the path to its connection file. The newest live kernel that matches
+    is used (see ipy_discovery.py).
     """
-    from simple_kernel import SimpleKernel
-    kernel = SimpleKernel(use_exist=True)
+    global km, kc
 
-    global km, kc, send
+    if int(vim_variable('g:ipy_use_helper', '0')):
+        description = _helper_connect('connect', s)
+        if description:
+            echo('Kernel Connected (through helper): %s' % description)
+        return km
+    try:
+        from simple_kernel import SimpleKernel
+    except ImportError:
+        echo("could not import jupyter_client, see :messages", 'Error')
+        print(_install_instructions)
+        return
+    kernel_info = ipy_discovery.find(s)
+    if kernel_info is None:
+        echo("no running kernel matches %r" % s, 'Error')
+        return
+    kernel = SimpleKernel(use_exist=True,
+                          connection_file=kernel_info['path'])
 
     km = kernel.kernel_manager
     kc = kernel.client
-    send = kernel.send
 
-    echo('Kernel Connected')
+    echo('Kernel Connected: %s' % ipy_discovery.describe(kernel_info))
 
     return km
 
 
+def kernel_completions(arglead):
+    """completions for :IPython's argument"""
+    return ipy_discovery.completions(arglead)
+
+
 def echo(arg, style="Question"):
     try:
         vim.command("echohl %s" % style)
@@ -132,22 +338,15 @@ def get_doc(word, level=0):
     if kc is None:
         return ["Not connected to IPython, cannot query: %s" % word]
     word += '?' * (level + 1)
-    msg_id = send(word)
+    try:
+        msg_id = send(word)
+    except Empty:  # the helper is gone, already reported
+        return ["no reply from IPython kernel"]
     doc = get_doc_msg(msg_id)
     # get around unicode problems when interfacing with vim
     return [d.encode(vim_encoding) for d in doc]
 
 
-# from http://serverfault.com/questions/71285/in-centos-4-4-how-can-i-strip-escape-sequences-from-a-text-file
-strip = re.compile('\x1B\[([0-9]{1,2}(;[0-9]{1,2})?)?[m|K]')
-
-
-def strip_color_escapes(s):
-    """replace special characters
-    """
-    return strip.sub('', s)
-
-
 def get_doc_msg(msg_id):
     """get doc msg
     """
@@ -223,25 +422,134 @@ def get_doc_buffer(level=0, visual=False):
         vim.command('setlocal syntax=python')
 
 
+def _char_index(line, col):
+    """convert a 0-based byte column from vim into a character index"""
+    return len(line.encode(vim_encoding)[:col].decode(vim_encoding, 'ignore'))
+
+
+def _complete_words(line, start, content):
+    """
+    Turn the matches of a complete_reply into whole words that replace the
+    text from character ``start`` up to the cursor, whatever ``cursor_start``
+    the kernel chose. Matches that don't fit that span are dropped.
+    """
+    cursor_start = content.get('cursor_start', start)
+    words = []
+    for match in content.get('matches', []):
+        if cursor_start <= start:
+            prefix = line[cursor_start:start]
+            if not match.startswith(prefix):
+                continue
+            words.append(match[len(prefix):])
+        else:
+            words.append(line[start:cursor_start] + match)
+    return words
+
+
+def _remember_completions(words):
+    """keep the most recently seen completions for complete_fallback"""
+    global _complete_cache
+    seen = set(words)
+    _complete_cache = words + [w for w in _complete_cache if w not in seen]
+    del _complete_cache[complete_cache_size:]
+
+
+def complete_fallback(base):
+    """
+    Local completions for when the kernel doesn't reply in time: names from
+    earlier kernel replies first, then words from the lines around the cursor.
+    """
+    matches = [w for w in _complete_cache if w.startswith(base) and w != base]
+    row = vim.current.window.cursor[0]
+    nearby = vim.current.buffer[max(row - 500, 0):row + 500]
+    for word in re.findall(r'[^\W\d][\w.]*', '\n'.join(nearby)):
+        if word.startswith(base) and word != base:
+            matches.append(word)
+    # drop duplicates, keeping the first occurrence
+    seen = set()
+    return [m for m in matches if not (m in seen or seen.add(m))]
+
+
 def ipy_complete(base, current_line, pos):
-    # pos is the location of the start of base, add the length
-    # to get the completion position
-    msg_id = kc.shell_channel.complete(base, current_line,
-                                       int(pos) + len(base) - 1)
+    # pos is the location of the start of base (1-based, in bytes); the
+    # completion position is just after base
+    start = _char_index(current_line, int(pos) - 1)
+    if kc is None:
+        return [base] + complete_fallback(base)
     try:
-        m = get_child_msg(msg_id)
-        matches = m['content']['matches']
-        matches.insert(0, base)  # the "no completion" version
-        # we need to be careful with unicode, because we can have unicode
-        # completions for filenames (for the %run magic, for example). So the next
-        # line will fail on those:
-        # completions= [str(u) for u in matches]
-        # because str() won't work for non-ascii characters
-        # and we also have problems with unicode in vim, hence the following:
-        return matches
+        msg_id = complete_request(current_line, start + len(base))
+        m = get_child_msg(msg_id, timeout=complete_timeout)
+        matches = _complete_words(current_line, start, m['content'])
+        _remember_completions(matches)
     except Empty:
-        echo("no reply from IPython kernel")
-        return ['']
+        echo("no reply from IPython kernel, using local completions")
+        matches = complete_fallback(base)
+    matches.insert(0, base)  # the "no completion" version
+    return matches
+
+
+def complete_async(base, line, col):
+    """
+    Send a completion request for ``base``, which starts at byte column
+    ``col`` (1-based) of ``line``, without waiting for the reply.
+
+    Only the most recent request is kept; replies to older ones are dropped
+    by complete_poll when they arrive.
+    """
+    global _complete_request
+    start = _char_index(line, int(col) - 1)
+    msg_id = None
+    if kc is not None:
+        try:
+            msg_id = complete_request(line, start + len(base))
+        except Empty:  # the helper is gone, already reported
+            pass
+    _complete_request = (msg_id, base, line, int(col), start, time.time())
+
+
+def complete_poll():
+    """
+    Check for the reply to the pending asynchronous completion request and
+    hand the matches to vim's complete(). Falls back to complete_fallback once
+    g:ipy_complete_timeout has passed.
+
+    Returns 1 once the request is settled, 0 if it should be polled again.
+    """
+    global _complete_request
+    if _complete_request is None:
+        return 1
+    msg_id, base, line, col, start, sent = _complete_request
+    content = None
+    try:
+        # replies to stale requests (or to anything else no longer waited
+        # for) are dropped on the way
+        if msg_id is not None:
+            m = wait_for_reply(get_shell_msg, msg_id, timeout=0)
+            content = m['content']
+    except Empty:
+        if time.time() - sent < complete_timeout:
+            return 0
+    _complete_request = None
+    # the user moved on, a newer request will follow if needed
+    if vim.eval('mode()') != 'i' or vim.current.line != line:
+        return 1
+    if content is not None and content.get('status', 'ok') == 'ok':
+        matches = _complete_words(line, start, content)
+        _remember_completions(matches)
+    else:
+        matches = complete_fallback(base)
+    if matches:
+        # base goes first so that the inserted completion changes nothing
+        # until a match is chosen
+        vim.command('call complete(%d, %s)' %
+                    (col, json.dumps([base] + matches, ensure_ascii=False)))
+    return 1
+
+
+def complete_cancel():
+    """forget the pending asynchronous completion request (on InsertLeave)"""
+    global _complete_request
+    _complete_request = None
 
 
 def vim_ipython_is_open():
@@ -263,7 +571,18 @@ def update_subchannel_msgs(debug=False, force=False):
     """
     if kc is None or (not vim_ipython_is_open() and not force):
         return False
-    msgs = kc.iopub_channel.get_msgs()
+    if isinstance(kc, HelperClient):
+        # the helper process has already rendered the messages
+        chunks = kc.get_output()
+    else:
+        msgs = kc.iopub_channel.get_msgs()
+        if _recorder is not None:
+            for m in msgs:
+                _recorder.record('iopub', m)
+        chunks = [
+            render_msg(m, status_prompt_in, status_prompt_out, display_cache)
+            for m in msgs
+        ]
     b = vim.current.buffer
     startedin_vimipython = vim.eval('@%') == 'vim-ipython'
     if not startedin_vimipython:
@@ -286,6 +605,8 @@ def update_subchannel_msgs(debug=False, force=False):
             vim.command("wincmd P")  # switch to preview window
             # subchannel window quick quit key 'q'
             vim.command('nnoremap <buffer> q :q<CR>')
+            # open the display data placeholder under the cursor
+            vim.command('nnoremap <buffer> <CR> :python3 open_display()<CR>')
             vim.command("set bufhidden=hide buftype=nofile ft=python")
             vim.command("setlocal nobuflisted")  # don't come up in buffer lists
             vim.command("setlocal nonumber")  # no line numbers, we have in/out nums
@@ -324,49 +645,13 @@ def update_subchannel_msgs(debug=False, force=False):
     }).replace('999', '[ 0-9]*')
     vim.command("syn match IPyPromptOut /^%s/" % out_expression)
     vim.command("syn match IPyPromptOut2 /^\\.\\.\\.* /")
+    vim.command("hi link IPyDisplay Special")
+    vim.command("syn match IPyDisplay /^\\[[-+.a-z]*\\/[-+.a-z]*\\] /")
     b = vim.current.buffer
     update_occured = False
-    for m in msgs:
-        s = ''
-        if 'msg_type' not in m['header']:
-            # debug information
-            # echo('skipping a message on sub_channel','WarningMsg')
-            # echo(str(m))
+    for s in chunks:
+        if s is None:
             continue
-        header = m['header']['msg_type']
-        if header == 'status':
-            continue
-        elif header == 'stream':
-            # TODO: alllow for distinguishing between stdout and stderr (using
-            # custom syntax markers in the vim-ipython buffer perhaps), or by
-            # also echoing the message to the status bar
-            try:
-                s = strip_color_escapes(m['content']['data'])
-            except KeyError:  # changed in IPython 3.0.0
-                s = strip_color_escapes(m['content']['text'])
-        elif header == 'pyout' or header == 'execute_result':
-            s = status_prompt_out % {'line': m['content']['execution_count']}
-            s += m['content']['data']['text/plain']
-        elif header == 'display_data':
-            # TODO: handle other display data types (HMTL? images?)
-            s += m['content']['data']['text/plain']
-        elif header == 'pyin' or header == 'execute_input':
-            # TODO: the next line allows us to resend a line to ipython if
-            # %doctest_mode is on. In the future, IPython will send the
-            # execution_count on subchannel, so this will need to be updated
-            # once that happens
-            line_number = m['content'].get('execution_count', 0)
-            prompt = status_prompt_in % {'line': line_number}
-            s = prompt
-            # add a continuation line (with trailing spaces if the prompt has them)
-            dots = '.' * len(prompt.rstrip())
-            dots += prompt[len(prompt.rstrip()):]
-            s += m['content']['code'].rstrip().replace('\n', '\n' + dots)
-        elif header == 'pyerr' or header == 'error':
-            c = m['content']
-            s = "\n".join(map(strip_color_escapes, c['traceback']))
-            s += c['ename'] + ":" + c['evalue']
-
         if s.find('\n') == -1:
             # somewhat ugly unicode workaround from
             # http://vim.1045645.n5.nabble.com/Limitations-of-vim-python-interface-with-respect-to-character-encodings-td1223881.html
@@ -389,19 +674,64 @@ def update_subchannel_msgs(debug=False, force=False):
     return update_occured
 
 
-def get_child_msg(msg_id):
-    # XXX: message handling should be split into its own process in the future
-    while True:
-        # get_msg will raise with Empty exception if no messages arrive in 1 second
-        m = kc.get_shell_msg(timeout=1)
-        if m['parent_header']['msg_id'] == msg_id:
-            break
-        # else:
-        # got a message, but not the one we were looking for
-        # echo('skipping a message on shell_channel', 'WarningMsg')
+def open_display():
+    """
+    Open the display data named by the placeholder on the current line of the
+    vim-ipython shell, e.g. "[image/png] /path/to/cache/3b1f8a2c-0.png"
+    """
+    import subprocess
+    import sys
+    match = re.match(r'\[[-+.\w]+/[-+.\w]+\] (.*)$', vim.current.line)
+    if not match:
+        echo("no display data on this line", "Error")
+        return
+    path = resolve(match.group(1))
+    if path is None:
+        echo("%s is not in the display cache (yet)" % match.group(1), "Error")
+        return
+    if display_opener:
+        subprocess.Popen(display_opener.split() + [path])
+    elif sys.platform == 'win32':
+        os.startfile(path)
+    else:
+        opener = 'open' if sys.platform == 'darwin' else 'xdg-open'
+        subprocess.Popen([opener, path])
+
+
+def send(code, **kwargs):
+    """
+    Send code to the kernel for execution (see KernelClient.execute for the
+    keyword arguments), returns the request's msg_id
+    """
+    msg_id = kc.execute(code, **kwargs)
+    if _recorder is not None:
+        _recorder.request('execute_request', msg_id)
+    return msg_id
+
+
+def complete_request(code, cursor_pos):
+    """send a completion request, returns its msg_id"""
+    msg_id = kc.complete(code, cursor_pos)
+    if _recorder is not None:
+        _recorder.request('complete_request', msg_id)
+    return msg_id
+
+
+def get_shell_msg(timeout=1):
+    """next message on the shell channel, recorded if a trace is running"""
+    m = kc.get_shell_msg(timeout=timeout)
+    if _recorder is not None:
+        _recorder.record('shell', m)
+    if m['header'].get('msg_type') == 'execute_reply':
+        # the kernel is done with the file send_code may have written
+        _remove_sent_file(m['parent_header'].get('msg_id'))
     return m
 
 
+def get_child_msg(msg_id, timeout=1):
+    return wait_for_reply(get_shell_msg, msg_id, timeout)
+
+
 def print_prompt(prompt, msg_id=None):
     """Print In[] or In[42] style messages"""
     global show_execution_count
@@ -427,13 +757,62 @@ def with_subchannel(f, *args):
         #         update_subchannel_msgs(force=True)
         # except AttributeError:  #if kc is None
         #     echo("not connected to IPython", 'Error')
-        f(*args)
+        try:
+            f(*args)
+        except Empty:
+            # the code never reached the kernel, HelperClient.execute has
+            # already said why
+            return
         if monitor_subchannel:
             update_subchannel_msgs(force=True)
 
     return f_with_update
 
 
+def send_code(code):
+    """
+    Send code for execution, either inline or, when it is longer than
+    g:ipy_inline_max_size, by writing it to a temporary file and running that
+    with %run -i. That keeps the execute request, its echo on
+    iopub and the vim-ipython shell small, however much code was selected.
+    The kernel has to be able to read the file, i.e. run on this machine.
+
+    Returns the msg_id and the temporary file's path (None if sent inline).
+    """
+    if not inline_max_size or len(code) <= inline_max_size:
+        return send(code), None
+    import tempfile
+    # .ipy, so that %run runs it as IPython code: magics, !commands and
+    # obj? work just as they do inline (and __file__ isn't set)
+    fd, path = tempfile.mkstemp(prefix='vim-ipython-', suffix='.ipy')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(code)
+    # always -i, not run_flags: the code has to run just as if it was sent
+    # inline, in the user namespace
+    try:
+        msg_id = send('%%run -i %s' % repr(path))
+    except Empty:
+        os.remove(path)
+        raise
+    _sent_files[msg_id] = path
+    return msg_id, path
+
+
+def _remove_sent_file(msg_id):
+    path = _sent_files.pop(msg_id, None)
+    if path is not None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@atexit.register
+def _remove_sent_files():
+    for msg_id in list(_sent_files):
+        _remove_sent_file(msg_id)
+
+
 @with_subchannel
 def run_this_file():
     msg_id = send('%%run %s %s' % (
@@ -485,7 +864,10 @@ def run_selected():
         lines[0] = lines[0][col1:]
         lines[-1] = lines[-1][:col2]
         selected = '\n'.join(lines)
-    msg_id = send(selected)
+    msg_id, path = send_code(selected)
+    if path is not None:
+        # don't echo the whole selection
+        selected = "lines %d-%d (run from %s)" % (lnum1, lnum2, path)
     print_prompt(selected, msg_id)
 
 
@@ -515,7 +897,7 @@ def run_these_lines(dedent=False):
         lines = "\n".join(x[leading:] for x in lines)
     else:
         lines = "\n".join(vim.current.buffer[r.start:r.end + 1])
-    msg_id = send(lines)
+    msg_id, path = send_code(lines)
     # alternative way of doing this in more recent versions of ipython
     # but %paste only works on the local machine
     # vim.command("\"*yy")
@@ -528,9 +910,45 @@ def run_these_lines(dedent=False):
     # vim lines start with 1
     # print("lines %d-%d sent to ipython"% (r.start+1,r.end+1))
     prompt = "lines %d-%d " % (r.start + 1, r.end + 1)
+    if path is not None:
+        prompt += "(run from %s) " % path
     print_prompt(prompt, msg_id)
 
 
+def record_trace(path=''):
+    """
+    Start recording the kernel messages vim-ipython receives to a trace file
+    (see ipy_trace.py), or stop if a recording is running. Traces can be
+    replayed without a kernel by ipy_replay.py.
+    """
+    global _recorder
+    if isinstance(kc, HelperClient):
+        # the helper sees the messages, so it does the recording
+        try:
+            stopped = kc.record('')
+        except Empty:  # the helper is gone, already reported
+            return
+    elif _recorder is not None:
+        _recorder.close()
+        stopped, _recorder = _recorder.path, None
+    else:
+        stopped = None
+    if stopped:
+        echo("stopped recording to %s" % stopped)
+        return
+    path = os.path.abspath(path or 'vim-ipython-trace.jsonl.gz')
+    if isinstance(kc, HelperClient):
+        try:
+            kc.record(path)
+        except Empty:
+            return
+    else:
+        import atexit
+        _recorder = TraceRecorder(path)
+        atexit.register(_recorder.close)
+    echo("recording kernel messages to %s" % path)
+
+
 def set_pid():
     """
     Explicitly ask the ipython kernel for its pid
@@ -539,9 +957,13 @@ def set_pid():
     lines = '\n'.join(['import os', '_pid = os.getpid()'])
 
     try:
-        msg_id = send(lines, silent=True, user_variables=['_pid'])
-    except TypeError:  # change in IPython 3.0+
-        msg_id = send(lines, silent=True, user_expressions={'_pid': '_pid'})
+        try:
+            msg_id = send(lines, silent=True, user_variables=['_pid'])
+        except TypeError:  # change in IPython 3.0+
+            msg_id = send(lines, silent=True,
+                          user_expressions={'_pid': '_pid'})
+    except Empty:  # the helper is gone, already reported
+        return
 
     # wait to get message back from kernel
     try:
@@ -562,6 +984,72 @@ def set_pid():
     return pid
 
 
+def namespace_buffer():
+    """the vim-ipython-namespace buffer, if it is visible"""
+    for w in vim.windows:
+        if w.buffer.name is not None and \
+                w.buffer.name.endswith("vim-ipython-namespace"):
+            return w.buffer
+    return None
+
+
+def namespace_explorer():
+    """
+    Open the vim-ipython-namespace buffer, which lists the kernel's variables
+    with their type, shape or length and approximate size, and refresh it.
+    """
+    opened = namespace_buffer() is None
+    if opened:
+        vim.command("silent botright vnew vim-ipython-namespace")
+        vim.command("setlocal buftype=nofile bufhidden=wipe noswapfile")
+        vim.command("setlocal nobuflisted nonumber nowrap")
+        # 'q' to quit, 'r' to refresh
+        vim.command('nnoremap <buffer> q :q<CR>')
+        vim.command('nnoremap <buffer> r :python3 namespace_refresh()<CR>')
+        vim.command("wincmd p")
+    # a new buffer is empty, even if the kernel has nothing new to report
+    namespace_refresh(redraw=opened)
+
+
+def namespace_refresh(redraw=False):
+    """
+    Ask the kernel what changed in its namespace since the last refresh, with
+    a single silent execute, and update the vim-ipython-namespace buffer.
+    ``redraw`` fills the buffer from the table vim-ipython already has first.
+    """
+    global _namespace_version
+    b = namespace_buffer()
+    if b is None:
+        return
+    if redraw:
+        b[:] = ipy_namespace.format_table(_namespace)
+    if kc is None:
+        echo("not connected to IPython", 'Error')
+        return
+    token, version = _namespace_version
+    expression = ipy_namespace.request_expression(version, token)
+    try:
+        msg_id = send(ipy_namespace.kernel_code, silent=True,
+                      user_expressions={'ns': expression})
+    except Empty:  # the helper is gone, already reported
+        return
+    try:
+        child = get_child_msg(msg_id)
+    except Empty:
+        echo("no reply from IPython kernel")
+        return
+    try:
+        update = ipy_namespace.parse_reply(
+            child['content']['user_expressions']['ns'])
+    except (KeyError, RuntimeError) as e:
+        echo("could not get the kernel namespace: %s" % e, 'Error')
+        return
+    ipy_namespace.apply_update(_namespace, update)
+    _namespace_version = (update['token'], update['version'])
+    if update['full'] or update['changed'] or update['removed']:
+        b[:] = ipy_namespace.format_table(_namespace)
+
+
 def terminate_kernel_hack():
     "Send SIGTERM to our the IPython kernel"
     import signal